@@ -11,3 +11,4 @@ Init module for AddC.
 
 from .base import AddC
 from .centroid import Centroid, KernelCentroid
+from .shared import SharedCentroids, SharedCentroidsReader
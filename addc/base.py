@@ -49,15 +49,30 @@ References
 # Licensed under the MIT Licence (http://opensource.org/licenses/MIT).
 
 from __future__ import print_function, division, absolute_import
-from .kernel import kernel_dist, gaussian
-from .centroid import Centroid, KernelCentroid
+from .kernel import kernel_dist, gaussian, median_bandwidth
+from .centroid import Centroid, KernelCentroid, tuned_centroid
+from collections import namedtuple
 from operator import itemgetter
 from fastpair import FastPair
+import numpy as np
 
 # Idea: use the kernel induced distance to compute a 'weighted' convex hull of points seen so far.
 # This might allow for non-circular clusters, and may in fact produce a more accurate clustering
 # If we can, we might even be able to estiamte an α paramter for 'online' α-shapes!?
 
+_default_dist = kernel_dist(gaussian)
+
+Summary = namedtuple("Summary",
+                     ["centers", "counts", "sizes", "mask", "spread"])
+
+
+def _size(c):
+    # Plain `Centroid`s don't track a kernel-induced size
+    try:
+        return c.size
+    except (AttributeError, IndexError):
+        return 0.0
+
 
 class AddC(object):
     """Implements the AddC clustering algorithm.
@@ -69,8 +84,8 @@ class AddC(object):
     data point. At any time, the data-structure can be queried for the current
     set of centroids/clusters, or updated with additional data points.
     """
-    def __init__(self, kmax=100, dist=kernel_dist(gaussian),
-                 centroid_factory=KernelCentroid):
+    def __init__(self, kmax=100, dist=_default_dist,
+                 centroid_factory=KernelCentroid, warmup=0, kernel=gaussian):
         """Initialize an empty FastPair data-structure.
 
         Parameters
@@ -80,19 +95,73 @@ class AddC(object):
             memory). This parameter controls the 'scale' of the desired
             solution, such that larger values of `kmax` will lead to a higher
             resolution cluster solution.
+        warmup : int, default=0
+            Number of initial points used to estimate the kernel bandwidth
+            (`sigma`) before streaming begins. These points are buffered
+            until `warmup` points have arrived (or `tune` is called), after
+            which the bandwidth is fixed and the buffered points are added
+            to the sketch. If 0 (the default), no tuning is performed.
+        kernel : function, default=gaussian
+            Kernel function with a `sigma` bandwidth parameter. Once warm-up
+            ends, this kernel (with the estimated bandwidth) is used for both
+            the distance and the centroid kernel. Only used when `warmup` > 0,
+            in which case this is the only kernel setting: passing a custom
+            `dist`, or a `centroid_factory` with a custom kernel, raises
+            `ValueError` rather than being silently replaced.
         """
+        if warmup > 0:
+            if dist is not _default_dist:
+                raise ValueError("with warmup, set the kernel via `kernel` "
+                                 "rather than `dist`")
+            if getattr(centroid_factory, "kernel", None) is not \
+                    KernelCentroid.kernel:
+                raise ValueError("with warmup, `centroid_factory` must use "
+                                 "the default KernelCentroid kernel")
+        elif kernel is not gaussian:
+            raise ValueError("`kernel` is only used with warmup; pass a "
+                             "kernel-induced `dist` instead")
         self.kmax = kmax
         self.npoints = 0
         self.centroid_factory = centroid_factory
         self.fastpair = FastPair(10, dist=dist)
+        self.warmup = warmup
+        self.kernel = kernel
+        self.sigma = None  # Bandwidth estimated during warm-up (if any)
+        self._buffer = []  # Points seen during warm-up
+        self._cache = None  # Array view of centroids, reset on each update
 
     def __add__(self, p):
         """Add a point to the AddC sketch."""
+        return self.add(p)
+
+    def add(self, p, weight=1):
+        """Add a (possibly pre-aggregated) point to the AddC sketch.
+
+        Parameters
+        ----------
+        p : tuple
+            An n-length tuple describing the point in n-dimensional space.
+        weight : int, default=1
+            The number of (duplicate or near-duplicate) points that `p`
+            represents, which must be a positive integer. The closest
+            centroid's `count` and `size` are updated for all `weight` points
+            in a single step.
+        """
+        if weight <= 0 or weight != int(weight):
+            raise ValueError("weight must be a positive integer, "
+                             "got {}".format(weight))
+        weight = int(weight)
+        if self.warmup > 0 and self.sigma is None:
+            self._buffer.append((p, weight))
+            if len(self._buffer) >= self.warmup:
+                self.tune()
+            return self
         c = self.centroid_factory(p)  # Create an 'empty' centroid at point `p`
-        self._step_one(c)
+        self._step_one(c, weight)
         self._step_two()
         self._step_three(c)
-        self.npoints += 1  # Update count of points seen so far
+        self.npoints += weight  # Update count of points seen so far
+        self._cache = None
         return self
 
     def __len__(self):
@@ -110,7 +179,7 @@ class AddC(object):
     def __iter__(self):
         return iter(self.fastpair)
 
-    def _step_one(self, c):
+    def _step_one(self, c, weight=1):
         # Step 1: Move the closest centroid towards the point
         if len(self.fastpair) > 0:
             # Single pass through list of neighbor points... this could also
@@ -120,7 +189,7 @@ class AddC(object):
             # _before_ querying for the closest pair (`step_two`), then we
             # could do it that way...
             old = min(self.fastpair.sdist(c), key=itemgetter(0))[1]
-            self.fastpair._update_point(old, old.add(c))
+            self.fastpair._update_point(old, old.add(c, weight))
 
     def _step_two(self):
         # Step 2: Merge the two closest centroids
@@ -133,17 +202,108 @@ class AddC(object):
         # Step 3: Set redundant centroid equal to new point
         self.fastpair += c
 
-    def batch(self, points):
+    def batch(self, points, weights=None):
         # No checks, no nothing... just batch processing, pure and simple
-        for point in points:
-            self += point
+        if weights is None:
+            for point in points:
+                self += point
+        else:
+            points, weights = list(points), list(weights)
+            if len(points) != len(weights):
+                raise ValueError("got {} points but {} weights".format(
+                    len(points), len(weights)))
+            for point, weight in zip(points, weights):
+                self.add(point, weight)
+        return self
+
+    def tune(self):
+        """End the warm-up phase and fix the kernel bandwidth.
+
+        The bandwidth is estimated from the points buffered so far using the
+        median heuristic (see `median_bandwidth`), after which the kernel
+        distance and centroid kernel are rebuilt and the buffered points are
+        added to the sketch. This is called automatically once `warmup`
+        points have arrived, but can be called early (e.g., if the stream
+        ends before the warm-up sample is complete).
+        """
+        if self.sigma is not None or len(self.fastpair) > 0:
+            raise RuntimeError("kernel bandwidth can only be tuned before "
+                               "streaming begins")
+        buffered, self._buffer = self._buffer, []
+        self.sigma = median_bandwidth([p for p, _ in buffered])
+        self.fastpair = FastPair(10, dist=kernel_dist(self.kernel,
+                                                      sigma=self.sigma))
+        self.centroid_factory = tuned_centroid(self.centroid_factory,
+                                               self.kernel, self.sigma)
+        self._cache = None
+        for p, weight in buffered:
+            self.add(p, weight)
         return self
 
+    def _arrays(self):
+        # Build (and cache) array views of the current centroids. The cache is
+        # dropped whenever a new point is added, so repeated reads between
+        # updates don't have to walk the FastPair structure again
+        if self._cache is None:
+            cs = list(self.fastpair)
+            if len(cs) > 0:
+                centers = np.array([c.center for c in cs], dtype=float)
+            else:
+                centers = np.empty((0, 0), dtype=float)
+            counts = np.array([c.count for c in cs], dtype=int)
+            sizes = np.array([_size(c) for c in cs], dtype=float)
+            for arr in (centers, counts, sizes):
+                arr.flags.writeable = False  # Shared by all cached summaries
+            self._cache = (cs, centers, counts, sizes, {})
+        return self._cache
+
+    def _mask(self, sizes, p):
+        # Guedalia et al. trimming: keep clusters whose size is at least `p`
+        # times the mean size of the non-empty clusters
+        sub = sizes[sizes > 0]
+        t = sub.mean() * p if len(sub) > 0 else 0.0
+        return sizes >= t
+
+    def summary(self, p=0.01):
+        """Return array-based summary statistics for the current clusters.
+
+        All arrays share the same ordering (the iteration order of the
+        underlying FastPair data-structure). Results are cached until the next
+        point is added, so repeated calls are essentially free. The returned
+        arrays are read-only; copy them before modifying.
+
+        Parameters
+        ----------
+        p : float, default=0.01
+            Trimming threshold, as a proportion of the mean (non-zero) cluster
+            size. See `trim` for details.
+
+        Returns
+        -------
+        summary : Summary
+            A namedtuple with fields `centers` (k x d array of cluster
+            centers), `counts` (k-length array of point counts), `sizes`
+            (k-length array of kernel-induced cluster sizes; zero for
+            centroid types that don't track a size, such as `Centroid`),
+            `mask` (k-length boolean array of clusters retained by `trim(p)`),
+            and `spread` (k-length array of the mean kernel-induced
+            dissimilarity, 1 - size/count, of the points absorbed by each
+            cluster; zero for empty clusters).
+        """
+        cs, centers, counts, sizes, seen = self._arrays()
+        if p not in seen:
+            spread = np.zeros(len(sizes), dtype=float)
+            nz = counts > 0
+            spread[nz] = 1 - sizes[nz] / counts[nz]
+            mask = self._mask(sizes, p)
+            spread.flags.writeable = mask.flags.writeable = False
+            seen[p] = Summary(centers, counts, sizes, mask, spread)
+        return seen[p]
+
     def trim(self, p=0.01):
         """Return only clusters over threshold."""
-        sub = [x.size for x in self if x.size > 0]
-        t = (sum(sub)/len(sub)) * p
-        return [x for x in self if x.size >= t]
+        cs = self._arrays()[0]
+        return [c for c, keep in zip(cs, self.summary(p).mask) if keep]
 
     @property
     def centroids(self):
@@ -11,9 +11,45 @@ Centroid module for AddC.
 
 from __future__ import print_function, division, absolute_import
 from collections import namedtuple
+from math import exp, floor
 from scipy import array
+from scipy.special import gammaln
+from numpy import arange, prod, float64
 from .kernel import gaussian
 
+
+def _shrinkage(s, k, w):
+    """Compute prod(1 - 1/(s + i*k) for i in 1..w) in constant time.
+
+    Each factor is (i + a)/(i + b), with a = (s - 1)/k and b = s/k, so the
+    product is a ratio of Gamma functions. Leading factors with s + i*k <= 1
+    are non-positive; they are handled as a separate block (using |i + a|),
+    so that all Gamma function arguments stay non-negative. Kernels with
+    k <= 0 (e.g., non-positive definite kernels) fall back to a direct
+    product.
+    """
+    if k == 0:
+        return (1 - 1 / float64(s))**w
+    if k < 0:
+        return prod(1 - 1 / (s + k*arange(1, w + 1)))
+    a, b = (s - 1) / k, s / k
+    # Number of leading non-positive factors (s + m*k <= 1 < s + (m+1)*k)
+    m = 0 if s + k > 1 else min(w, int(floor(-a)))
+    while m < w and s + (m + 1)*k <= 1:
+        m += 1
+    while m > 0 and s + m*k > 1:
+        m -= 1
+    # Leading block: prod |i + a| = Γ(-a)/Γ(-a - m), which is zero when
+    # some s + i*k == 1 exactly (gammaln(0) is infinite)
+    log = 0.0
+    if m > 0:
+        log += gammaln(-a) - gammaln(-a - m)
+        log += gammaln(1 + b) - gammaln(m + 1 + b)
+    if m < w:
+        log += gammaln(w + 1 + a) - gammaln(m + 1 + a)
+        log += gammaln(m + 1 + b) - gammaln(w + 1 + b)
+    return (-1)**m * exp(log) if log > -float("inf") else 0.0
+
 class Centroid(namedtuple("Centroid", ["center", "count", "size"])):
     """AddC cluster centroid object.
 
@@ -71,27 +107,33 @@ class Centroid(namedtuple("Centroid", ["center", "count", "size"])):
     def __hash__(self):
         return hash(tuple(self.center))
 
+    def __getnewargs__(self):
+        # Slicing gives the namedtuple fields (iterating gives the center)
+        return self[:]
+
     def __add__(self, other):
+        return self.add(other)
+
+    def add(self, other, weight=1):
+        """Update centroid with `weight` copies of a new data point."""
         try:
             other = array(other)
         except:
             raise TypeError("unsupported operand type(s) for +:"
                             " 'Centroid' and '{}'".format(type(other)))
-        center = self.center + ((other - array(other)) / (self.count+1))
-        count = self.count + 1
+        x = array(self.center)
+        count = self.count + weight
+        center = x + weight * (other - x) / count
         return type(self)(center, count=count)
 
-    def add(self, other):
-        return self + other
-
     def merge(self, other):
         """Merge two existing centroids to form a new centroid."""
         if not isinstance(other, type(self)):
             raise TypeError("unsupported operand type(s) for +:"
                             " 'Centroid' and '{}'".format(type(other)))
         x, y = array(self.center)*self.count, array(other.center)*other.count
-        center = (x + y) / (a.count + b.count)
-        count = a.count + b.count
+        center = (x + y) / (self.count + other.count)
+        count = self.count + other.count
         return type(self)(center=center, count=count)
 
 # Specify default args for this named tuple
@@ -120,10 +162,13 @@ class KernelCentroid(Centroid):
         if not isinstance(other, type(self)):
             raise TypeError("unsupported operand type(s) for +:"
                             " 'Centroid' and '{}'".format(type(other)))
-        x, y = array(self.center)*self.size, array(other.center)*other.size
-        center = (x + y) / (self.size + other.size)
-        count = self.count + other.count
+        x, y = array(self.center), array(other.center)
         size = self.size + other.size
+        if size > 0:
+            center = (x*self.size + y*other.size) / size
+        else:  # Neither centroid has absorbed any points yet
+            center = (x + y) / 2
+        count = self.count + other.count
         return type(self)(center=center, count=count, size=size)
 
     kernel = lambda self, a, b: gaussian(a, b)
@@ -135,10 +180,66 @@ class KernelCentroid(Centroid):
         center --> y_winner = y_winner + (x - y_winner) / c_winner
         count --> just add 1
         """
+        return self.add(other)
+
+    def add(self, other, weight=1):
+        """Update centroid with `weight` (pre-aggregated) copies of new data.
+
+        size --> c_winner = c_winner + w*K(x, y_winner)
+        center --> y_winner = x - (x - y_winner) * prod_i(1 - 1/c_i)
+        count --> just add w
+
+        where c_i = c_winner + i*K(x, y_winner) for i = 1..w. This is the
+        closed form of `w` successive unit updates, with the kernel evaluated
+        once at the current center, and is computed in constant time. It is
+        exact for `weight=1` (identical to `self + other`), and a close
+        approximation for near-duplicate points, where the kernel barely
+        changes as the center moves.
+        """
         x, y = array(self.center), array(other.center)
-        size = self.size + self.kernel(self.center, other.center)
-        center = x + (y - x) / size
-        count = self.count + 1
+        k = self.kernel(self.center, other.center)
+        center = y - (y - x) * _shrinkage(self.size, k, weight)
+        size = self.size + weight*k
+        count = self.count + weight
         return type(self)(center, count, size)
 
 KernelCentroid.__new__.__defaults__ = (0, 0.0, )
+
+
+class _TunedKernel(object):
+    """Mixin giving a centroid class a kernel with a fixed bandwidth.
+
+    Classes using this mixin are created (and cached) by `tuned_centroid`.
+    Instances pickle by reference to that factory, so they can be unpickled
+    even though the classes themselves are created at runtime.
+    """
+
+    __slots__ = ()
+
+    def kernel(self, a, b):
+        return self.base_kernel(a, b, sigma=self.sigma)
+
+    def __reduce__(self):
+        return (_rebuild, (self.factory, self.base_kernel, self.sigma,
+                           self.__getnewargs__()))
+
+
+_tuned = {}
+
+
+def tuned_centroid(factory, kernel, sigma):
+    """Return a subclass of `factory` using `kernel` with bandwidth `sigma`.
+
+    The same class is returned for the same arguments, so centroids created
+    by (or unpickled from) separate calls can still be merged.
+    """
+    key = (factory, kernel, sigma)
+    if key not in _tuned:
+        _tuned[key] = type(factory.__name__, (_TunedKernel, factory), {
+            "__slots__": (), "factory": factory,
+            "base_kernel": staticmethod(kernel), "sigma": sigma})
+    return _tuned[key]
+
+
+def _rebuild(factory, kernel, sigma, fields):
+    return tuned_centroid(factory, kernel, sigma)(*fields)
@@ -14,6 +14,7 @@ from math import exp, tanh, sqrt, pi as PI, acos, e as E
 import scipy.spatial.distance as dist
 from scipy import dot
 from functools import partial
+import numpy as np
 
 
 def linear(x, y, c=0):
@@ -62,7 +63,7 @@ def gaussian(x, y, sigma=1):
     the function will lack regularization and the decision boundary will be
     highly sensitive to noise in training data.
     """
-    return exp(-(dist.sqeuclidean(x, y)/2*sigma**2))
+    return exp(-(dist.sqeuclidean(x, y) / (2*sigma**2)))
 
 
 def exponential(x, y, sigma=1):
@@ -83,7 +84,7 @@ def exponential(x, y, sigma=1):
     --------
     gaussian
     """
-    return exp(-(dist.euclidean(x, y) / 2*sigma**2))
+    return exp(-(dist.euclidean(x, y) / (2*sigma**2)))
 
 
 def laplacian(x, y, sigma=1):
@@ -190,6 +191,27 @@ def circular(x, y, sigma):
     return pi2*acos(-norm_sigma) - pi2*norm_sigma*sqrt(1 - norm_sigma**2)
 
 
+def median_bandwidth(points, default=1.0):
+    """Estimate a kernel bandwidth (`sigma`) via the median heuristic.
+
+    The bandwidth is chosen to be the median Euclidean distance between all
+    pairs of `points`, which means that a typical pair of points has a
+    Gaussian kernel value of exp(-1/2). This keeps kernel-induced distances
+    away from their saturation point (i.e., all distances near 2), where
+    closest-pair ties become very common. The pairwise distances are computed
+    in a single vectorized pass, so this is intended to be used on a modest
+    'warm-up' sample of points.
+
+    If there are fewer than two points, or all points are identical, the
+    `default` bandwidth is returned instead.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return default
+    d = np.median(dist.pdist(points))
+    return d if d > 0 else default
+
+
 def kernel_dist(kernel=linear, **kw):
     """Generic kernel-induced distance metric.
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""AddC: Data-structure for online/streaming clustering.
+
+Replay module for AddC.
+
+This module provides a deterministic harness for checking alternative (e.g.,
+vectorized, compiled, or approximate) implementations of AddC against the
+reference `AddC` implementation. A recorded (or seeded, randomly generated)
+stream of points is fed to both implementations one point at a time, and
+their centroids are compared step by step. The harness reports the time
+spent in each implementation, as well as the divergence between them.
+
+Any object with an `add(point, weight)` method and a `centroids` property
+(returning a sequence of n-dimensional points) can be replayed.
+"""
+
+# Copyright (c) 2016, Carson J. Q. Farmer <carsonfarmer@gmail.com>
+# Licensed under the MIT Licence (http://opensource.org/licenses/MIT).
+
+from __future__ import print_function, division, absolute_import
+from collections import namedtuple
+import random
+import timeit
+import numpy as np
+from scipy.spatial.distance import cdist
+
+Report = namedtuple("Report", ["steps", "reference_time", "candidate_time",
+                               "speedup", "divergence", "first_divergence"])
+
+
+def random_stream(n=500, dim=2, k=3, sd=0.05, noise=0.1, max_weight=1,
+                  seed=None):
+    """Generate a reproducible stream of clustered points and weights.
+
+    Points are drawn around `k` random cluster means in the unit hypercube,
+    with a proportion `noise` of uniformly distributed points mixed in.
+    Weights are drawn uniformly from 1 to `max_weight` (inclusive). The same
+    `seed` always produces the same stream.
+
+    Returns
+    -------
+    points, weights : list, list
+        A list of `n` `dim`-length tuples, and a list of `n` integer weights.
+    """
+    rng = random.Random(seed)
+    means = [[rng.random() for _ in range(dim)] for _ in range(k)]
+    points, weights = [], []
+    for _ in range(n):
+        if rng.random() < noise:
+            point = tuple(rng.random() for _ in range(dim))
+        else:
+            mean = rng.choice(means)
+            point = tuple(rng.normalvariate(m, sd) for m in mean)
+        points.append(point)
+        weights.append(rng.randint(1, max_weight))
+    return points, weights
+
+
+def divergence(a, b):
+    """Compute the divergence between two sets of centroids.
+
+    This is the (symmetric) Hausdorff distance between the two sets, so that
+    it does not depend on the order in which the centroids are stored. If the
+    sets have different sizes, or either contains non-finite values, the
+    divergence is infinite.
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    if len(a) != len(b) or not (np.isfinite(a).all() and
+                                np.isfinite(b).all()):
+        return float("inf")
+    if len(a) == 0:
+        return 0.0
+    d = cdist(a, b)
+    return max(d.min(axis=0).max(), d.min(axis=1).max())
+
+
+def replay(points, reference, candidate, weights=None, tol=1e-8, every=1):
+    """Replay a stream of points through two AddC implementations.
+
+    Parameters
+    ----------
+    points : sequence
+        The (recorded) stream of points.
+    reference : callable
+        Function returning a new, empty, reference sketch (e.g.,
+        `lambda: AddC(10)`).
+    candidate : callable
+        Function returning a new, empty, sketch to compare against the
+        reference.
+    weights : sequence, optional
+        Weight of each point in `points`. Defaults to unit weights.
+    tol : float, default=1e-8
+        Divergence above which the two sketches are considered to differ.
+    every : int, default=1
+        Compare centroids every `every` steps (and after the last step).
+        Comparisons are not included in the reported times.
+
+    Returns
+    -------
+    report : Report
+        A namedtuple with fields `steps` (number of points replayed),
+        `reference_time` and `candidate_time` (seconds spent adding points to
+        each sketch), `speedup` (reference time over candidate time),
+        `divergence` (the largest divergence seen at any compared step), and
+        `first_divergence` (the first step at which the divergence exceeded
+        `tol`, or None).
+    """
+    if weights is None:
+        weights = [1] * len(points)
+    ref, cand = reference(), candidate()
+    ref_time = cand_time = 0.0
+    worst, first = 0.0, None
+    timer = timeit.default_timer
+    for step, (point, weight) in enumerate(zip(points, weights)):
+        start = timer()
+        ref.add(point, weight)
+        ref_time += timer() - start
+        start = timer()
+        cand.add(point, weight)
+        cand_time += timer() - start
+        if (step + 1) % every == 0 or step + 1 == len(points):
+            d = divergence(ref.centroids, cand.centroids)
+            worst = max(worst, d)
+            if first is None and d > tol:
+                first = step
+    speedup = ref_time / cand_time if cand_time > 0 else float("inf")
+    return Report(len(points), ref_time, cand_time, speedup, worst, first)
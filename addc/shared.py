@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""AddC: Data-structure for online/streaming clustering.
+
+Shared-memory module for AddC.
+
+This module allows the current set of centroids from an `AddC` sketch to be
+published into a named `multiprocessing.shared_memory` segment, so that
+readers in other processes can map the centroid arrays directly (zero-copy)
+instead of receiving pickled copies over a pipe. Consistency is maintained
+with a sequence lock (seqlock): the writer increments a version counter
+before and after each update (so the counter is odd while a write is in
+progress), and readers retry whenever the counter is odd or has changed
+while they were reading.
+
+The segment layout is an int64 header `[seq, capacity, dim, k, tracker]`
+(`tracker` identifies the writer's resource tracker; see `_tracker_id`)
+followed by float64 arrays of `centers` (capacity x dim), `counts`
+(capacity), and `sizes` (capacity), of which only the first `k` rows are
+valid.
+
+Requires Python 3.8 or later.
+"""
+
+# Copyright (c) 2016, Carson J. Q. Farmer <carsonfarmer@gmail.com>
+# Licensed under the MIT Licence (http://opensource.org/licenses/MIT).
+
+from __future__ import print_function, division, absolute_import
+from collections import namedtuple
+import os
+import time
+import numpy as np
+from scipy.spatial.distance import cdist
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+_HEADER = 5  # seq, capacity, dim, k, tracker
+
+Snapshot = namedtuple("Snapshot", ["version", "centers", "counts", "sizes"])
+
+
+def _layout(buf, capacity, dim):
+    # Map the header and centroid arrays onto a shared buffer
+    header = np.ndarray((_HEADER,), dtype=np.int64, buffer=buf)
+    offset = header.nbytes
+    centers = np.ndarray((capacity, dim), dtype=np.float64, buffer=buf,
+                         offset=offset)
+    offset += centers.nbytes
+    counts = np.ndarray((capacity,), dtype=np.float64, buffer=buf,
+                        offset=offset)
+    offset += counts.nbytes
+    sizes = np.ndarray((capacity,), dtype=np.float64, buffer=buf,
+                       offset=offset)
+    return header, centers, counts, sizes
+
+
+def _tracker_id():
+    # Identify the resource tracker this process talks to by the inode of
+    # its pipe. Unlike the tracker's pid (which is only known to the process
+    # that started it), this is the same in every process sharing a tracker,
+    # including forked and spawned multiprocessing children. Returns 0 if
+    # the tracker can't be identified.
+    tracker = getattr(resource_tracker, "_resource_tracker", None)
+    fd = getattr(tracker, "_fd", None)
+    if fd is None:
+        return 0
+    try:
+        return os.fstat(fd).st_ino
+    except OSError:
+        return 0
+
+
+def _attach(name):
+    # Attach to an existing segment without handing ownership (and therefore
+    # clean-up) of it to this process's resource tracker
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+    # Attaching registers the segment with our resource tracker, which would
+    # unlink it when this process exits. Unregister it, but only if our
+    # tracker is known to differ from the writer's. When they are the same
+    # (e.g., reading in the writer's process, its parent, or a child), this
+    # would drop the writer's own registration. If either tracker can't be
+    # identified, the registration is left alone: the segment may then be
+    # unlinked when this process exits, so keep such readers alive for as
+    # long as the writer
+    header = np.ndarray((_HEADER,), dtype=np.int64, buffer=shm.buf)
+    tracker = _tracker_id()
+    if tracker and header[4] and tracker != header[4]:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    del header
+    return shm
+
+
+class SharedCentroids(object):
+    """Publish the centroids of an AddC sketch into shared memory.
+
+    The segment is created with room for `ac.kmax` (at least two) centroids
+    of dimension `dim`. Call `publish` whenever readers should see the latest
+    centroids (e.g., after each batch of updates). The creating process owns
+    the segment and should call `close` and `unlink` when done (or use this
+    object as a context manager).
+
+    Parameters
+    ----------
+    ac : AddC
+        The sketch whose centroids are to be published.
+    dim : int
+        The dimension of the points (and centroids) in the sketch.
+    name : str, optional
+        Name of the shared memory segment. If not given, a unique name is
+        generated; either way it is available as `name`, and is what readers
+        need to attach (see `SharedCentroidsReader`).
+    """
+    def __init__(self, ac, dim, name=None):
+        if shared_memory is None:
+            raise ImportError("shared memory requires Python 3.8 or later")
+        self.ac = ac
+        # AddC only merges when it has at least two centroids, so it can hold
+        # two even when `kmax` is 1
+        self.capacity = max(ac.kmax, 2)
+        self.dim = dim
+        size = (_HEADER + self.capacity*(dim + 2)) * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=size)
+        self._header, self._centers, self._counts, self._sizes = \
+            _layout(self.shm.buf, self.capacity, dim)
+        self._header[:] = (0, self.capacity, dim, 0, _tracker_id())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        self.unlink()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def version(self):
+        """Number of times the centroids have been published."""
+        return int(self._header[0]) // 2
+
+    def publish(self):
+        """Copy the current centroids into shared memory.
+
+        Returns the new version number.
+        """
+        s = self.ac.summary()
+        k = len(s.counts)
+        if k > self.capacity:
+            raise ValueError("sketch has {} centroids, but shared memory only "
+                             "has room for {}".format(k, self.capacity))
+        if k > 0 and s.centers.shape[1] != self.dim:
+            raise ValueError("expected centroids of dimension {}, got "
+                             "{}".format(self.dim, s.centers.shape[1]))
+        self._header[0] += 1  # Odd: write in progress
+        self._centers[:k] = s.centers
+        self._counts[:k] = s.counts
+        self._sizes[:k] = s.sizes
+        self._header[3] = k
+        self._header[0] += 1  # Even: write complete
+        return self.version
+
+    def close(self):
+        self._header = self._centers = self._counts = self._sizes = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class SharedCentroidsReader(object):
+    """Read AddC centroids published by `SharedCentroids` in another process.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory segment to attach to (see
+        `SharedCentroids.name`).
+    """
+    def __init__(self, name):
+        if shared_memory is None:
+            raise ImportError("shared memory requires Python 3.8 or later")
+        self.shm = _attach(name)
+        header = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.capacity, self.dim = int(header[1]), int(header[2])
+        self._header, self._centers, self._counts, self._sizes = \
+            _layout(self.shm.buf, self.capacity, self.dim)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def version(self):
+        """Number of times the centroids have been published."""
+        return int(self._header[0]) // 2
+
+    def _consistent(self, func):
+        # Seqlock read: apply `func` to (zero-copy) views of the centroid
+        # arrays, retrying if a write started or finished in the meantime
+        while True:
+            seq = int(self._header[0])
+            if seq % 2 == 0:
+                k = int(self._header[3])
+                try:
+                    result = func(self._centers[:k], self._counts[:k],
+                                  self._sizes[:k])
+                except ValueError:
+                    # A torn read can look invalid (e.g., no centroids);
+                    # only report the error if nothing changed meanwhile
+                    if int(self._header[0]) == seq:
+                        raise
+                else:
+                    if int(self._header[0]) == seq:
+                        return seq // 2, result
+            time.sleep(0)
+
+    def read(self):
+        """Return a consistent copy of the currently published centroids.
+
+        Returns
+        -------
+        snapshot : Snapshot
+            A namedtuple with fields `version`, `centers` (k x d array),
+            `counts` (k-length array), and `sizes` (k-length array).
+        """
+        version, arrays = self._consistent(
+            lambda centers, counts, sizes: (centers.copy(), counts.copy(),
+                                            sizes.copy()))
+        return Snapshot(version, *arrays)
+
+    def predict(self, X):
+        """Return the index of the closest centroid to each point in `X`.
+
+        Distances are computed directly on the shared arrays, without copying
+        them. Closeness is measured by Euclidean distance, which gives the same
+        result as the kernel-induced distance for radial kernels (e.g., the
+        default Gaussian kernel).
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+
+        def closest(centers, counts, sizes):
+            if len(centers) == 0:
+                raise ValueError("no centroids have been published")
+            return cdist(X, centers, "sqeuclidean").argmin(axis=1)
+        return self._consistent(closest)[1]
+
+    def close(self):
+        self._header = self._centers = self._counts = self._sizes = None
+        self.shm.close()
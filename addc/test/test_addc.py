@@ -14,10 +14,21 @@ from __future__ import print_function, division, absolute_import
 # from operator import itemgetter
 # from types import FunctionType
 # from itertools import cycle, combinations, groupby
+import os
+import sys
 import random
+import pickle
+import subprocess
+import multiprocessing
 import pytest
 from addc import AddC, Centroid, KernelCentroid
-from math import isinf, isnan
+from addc import SharedCentroids, SharedCentroidsReader
+from addc.shared import shared_memory
+from addc.replay import replay, random_stream, divergence
+from addc.kernel import gaussian, exponential, laplacian, median_bandwidth
+from addc.kernel import kernel_dist
+from addc.centroid import tuned_centroid
+from math import isinf, isnan, exp
 
 def contains_same(s, t):
     s, t = set(s), set(t)
@@ -38,18 +49,16 @@ def rand_tuple(dim=2):
     return tuple([random.random() for _ in range(dim)])
 
 
-@pytest.fixture(scope="module")
 def ClusterSet(n=100, means=[(.6, .5), (.3, .8), (.2, .4)], sd=0.02):
-    # random.seed(8714)
+    random.seed(8714)
     data = [rand_normal(mean, sd) for _ in range(n) for mean in means]
     data += [rand_tuple() for _ in range(n//2)]  # Noise
     return data
 
 
-@pytest.fixture(scope="module")
 def PointSet(n=50, d=10):
     """Return numpy array of shape `n`x`d`."""
-    # random.seed(8714)
+    random.seed(8714)
     return [rand_tuple(d) for _ in range(n)]
 
 
@@ -90,6 +99,43 @@ class TestAddC:
             assert a.count == b.count
             assert abs(a.size - b.size) < 1e-8
 
+    def test_add_weighted(self):
+        ps = PointSet()
+        ac1 = AddC(10)
+        ac2 = AddC(10)
+        for p in ps:
+            ac1 += p
+            ac2.add(p, weight=1)
+        for a, b in zip(ac1, ac2):
+            assert all_close(a.center, b.center)
+            assert a.count == b.count
+        ac3 = AddC(10).batch(ps, weights=[3]*len(ps))
+        assert ac3.npoints == 3*len(ps)
+        assert sum(ac3.summary().counts) == 3*(len(ps) - 1)
+        with pytest.raises(ValueError):
+            ac3.add(ps[0], weight=0)
+        with pytest.raises(ValueError):
+            ac3.add(ps[0], weight=2.5)
+        ac3.add(ps[0], weight=2.0)
+        assert ac3.npoints == 3*len(ps) + 2
+
+    def test_batch_weights(self):
+        ps = PointSet()
+        ws = [random.randint(1, 5) for _ in ps]
+        ac1 = AddC(10)
+        for p, w in zip(ps, ws):
+            ac1.add(p, w)
+        ac2 = AddC(10).batch(ps, ws)
+        assert ac1.npoints == ac2.npoints == sum(ws)
+        with pytest.raises(ValueError):
+            AddC(10).batch(ps, ws[:-1])
+        with pytest.raises(ValueError):
+            AddC(10).batch(iter(ps[:-1]), iter(ws))
+        for a, b in zip(ac1, ac2):
+            assert all_close(a.center, b.center)
+            assert a.count == b.count
+            assert abs(a.size - b.size) < 1e-8
+
     def test_kernel(self):
         # For now, we're only testing the gaussian kernel
         ps = PointSet()
@@ -97,6 +143,57 @@ class TestAddC:
         # assert getattr(ac.dist, "__name__") == "gaussian"
         assert (ac.fastpair.dist((1, 2, 3, 4, 5), (6, 5, 4, 3, 2)) - 2) < 1e-8
 
+    def test_warmup(self):
+        ps = PointSet()
+        ac = AddC(10, warmup=20)
+        ac.batch(ps[:19])
+        assert ac.sigma is None
+        assert len(ac) == 0
+        ac += ps[19]
+        assert ac.sigma == median_bandwidth(ps[:20])
+        assert len(ac) == 10
+        assert ac.npoints == 20
+        ac.batch(ps[20:])
+        assert ac.npoints == len(ps)
+        d = ac.fastpair.dist(ps[0], ps[1])
+        assert abs(d - (2 - 2*gaussian(ps[0], ps[1], ac.sigma))) < 1e-8
+        c = ac.centroid_factory(ps[0])
+        k = gaussian(ps[0], ps[1], ac.sigma)
+        assert abs(c.kernel(ps[0], ps[1]) - k) < 1e-8
+        for c in ac.trim():
+            d = pickle.loads(pickle.dumps(c))
+            assert type(d) is type(c)
+            assert d == c and d.count == c.count and d.size == c.size
+            assert abs(d.kernel(ps[0], ps[1]) - k) < 1e-8
+
+    def test_warmup_kernel(self):
+        ps = PointSet()
+        ac = AddC(10, warmup=20, kernel=laplacian).batch(ps)
+        d = ac.fastpair.dist(ps[0], ps[1])
+        k = laplacian(ps[0], ps[1], ac.sigma)
+        assert abs(d - (2 - 2*k)) < 1e-8
+        c = ac.centroid_factory(ps[0])
+        assert abs(c.kernel(ps[0], ps[1]) - k) < 1e-8
+        # Conflicting kernel settings aren't silently overridden
+        with pytest.raises(ValueError):
+            AddC(10, dist=kernel_dist(laplacian), warmup=20)
+        factory = tuned_centroid(KernelCentroid, laplacian, 1.0)
+        with pytest.raises(ValueError):
+            AddC(10, centroid_factory=factory, warmup=20)
+        with pytest.raises(ValueError):
+            AddC(10, centroid_factory=Centroid, warmup=20)
+        with pytest.raises(ValueError):
+            AddC(10, kernel=laplacian)
+
+    def test_tune(self):
+        ps = PointSet()
+        ac = AddC(warmup=len(ps) + 1).batch(ps)
+        assert len(ac) == 0
+        ac.tune()
+        assert len(ac) == ac.npoints == len(ps)
+        with pytest.raises(RuntimeError):
+            ac.tune()
+
     def test_len(self):
         ps = PointSet()
         ac = AddC(kmax=8)
@@ -154,6 +251,54 @@ class TestAddC:
         for a, b in zip(sorted(centroids), sorted(means)):
             assert all_close(a, b, sd)  # Tolerance equal to sd...
 
+    def test_summary(self):
+        ps = PointSet()
+        ac = AddC(kmax=8).batch(ps)
+        s = ac.summary(0.2)
+        assert s.centers.shape == (8, len(ps[0]))
+        assert len(s.counts) == len(s.sizes) == len(s.mask) == len(s.spread)
+        assert s.mask.sum() == len(ac.trim(0.2))
+        assert all(0 <= x <= 1 for x in s.spread)
+        for a, b in zip(s.centers, ac.centroids):
+            assert all_close(a, b)
+        assert ac.summary(0.2) is s  # Cached until next update
+        for arr in s:
+            with pytest.raises(ValueError):
+                arr[:] = 99
+        ac += ps[0]
+        assert ac.summary(0.2) is not s
+
+    def test_plain_centroid(self):
+        ps = PointSet(4, 2)
+        ac = AddC(5, centroid_factory=Centroid).batch(ps)
+        assert len(ac.centroids) == len(ps)
+        s = ac.summary()
+        assert s.centers.shape == (len(ps), 2)
+        assert (s.sizes == 0).all()
+        assert s.counts.sum() == len(ps) - 1
+        assert len(ac.trim()) == len(ps)
+
+    def test_trim_empty(self):
+        ac = AddC()
+        assert ac.trim() == []
+        ac += (0.5, 0.5)  # A single centroid with zero size
+        assert len(ac.trim()) == 1
+
+class TestKernel:
+    def test_gaussian(self):
+        assert abs(gaussian((0, 0), (2, 0), sigma=2) - exp(-0.5)) < 1e-8
+        assert abs(exponential((0, 0), (2, 0), sigma=2) - exp(-0.25)) < 1e-8
+
+    def test_median_bandwidth(self):
+        ps = PointSet()
+        sigma = median_bandwidth(ps)
+        assert sigma > 0
+        scaled = [tuple(100*x for x in p) for p in ps]
+        assert abs(median_bandwidth(scaled) - 100*sigma) < 1e-6
+        assert median_bandwidth(ps[:1]) == 1.0
+        assert median_bandwidth([ps[0]]*5, default=2.0) == 2.0
+
+
 class TestCentroid:
     def test_init(self):
         compare = (1, 2, 3, 4, 5)
@@ -173,7 +318,304 @@ class TestCentroid:
         for i, item in enumerate(c):
             assert item == compare[i]
 
+    def test_add_weight(self):
+        a = KernelCentroid((0, 0), 1, 1.0)
+        b = KernelCentroid((1, 1))
+        c = a.add(b, weight=4)
+        assert c.count == 5
+        assert abs(c.size - (1 + 4*a.kernel(a.center, b.center))) < 1e-8
+        assert all_close(a + b, a.add(b))
+
+    @pytest.mark.parametrize("weight", [2, 5, 20, 100])
+    def test_add_weight_sequential(self, weight):
+        # A near-duplicate point: matches `weight` successive unit updates
+        a = KernelCentroid((0, 0), 5, 4.0)
+        b = KernelCentroid((0.05, 0.02))
+        c = a.add(b, weight)
+        d = a
+        for _ in range(weight):
+            d = d + b
+        assert all_close(c.center, d.center, 1e-3)
+        assert abs(c.size - d.size) < 1e-2*weight
+
+    @pytest.mark.parametrize("s, k", [(4.0, 0.5), (0.0, 0.3), (0.5, 0.25),
+                                      (0.2, 0.011), (2.0, 0.0)])
+    def test_shrinkage(self, s, k):
+        from addc.centroid import _shrinkage
+        for w in (1, 2, 3, 10, 100, 5000):
+            direct = 1.0
+            for i in range(1, w + 1):
+                direct *= 1 - 1 / (s + i*k)
+            tol = 1e-8*max(1, abs(direct))
+            assert abs(_shrinkage(s, k, w) - direct) <= tol
+
+    def test_add_weight_large(self):
+        a = KernelCentroid((0, 0), 5, 4.0)
+        b = KernelCentroid((1.177, 0))
+        c = a.add(b, weight=10**12)
+        assert c.count == 5 + 10**12
+        assert 1.177 - 1e-6 < c.center[0] <= 1.177
+
+    @pytest.mark.parametrize("weight", [1, 20, 1000])
+    def test_add_weight_no_overshoot(self, weight):
+        # A distant point: the center never moves past the point
+        a = KernelCentroid((0, 0), 5, 4.0)
+        for x in (1.177, 3.0):
+            c = a.add(KernelCentroid((x, 0)), weight)
+            assert 0 < c.center[0] <= x
+
+    def test_merge(self):
+        a = Centroid((0, 0), 1)
+        b = Centroid((3, 3), 2)
+        c = a.merge(b)
+        assert c.center == (2, 2)
+        assert c.count == 3
+        with pytest.raises(TypeError):
+            a.merge((3, 3))
+
+    def test_merge_empty(self):
+        c = KernelCentroid((0, 0)).merge(KernelCentroid((2, 4)))
+        assert c.center == (1, 2)
+        assert c.size == 0
+
+    def test_pickle(self):
+        c = KernelCentroid((1, 2), 3, 1.5)
+        d = pickle.loads(pickle.dumps(c))
+        assert type(d) is KernelCentroid
+        assert d.center == c.center and d.count == 3 and d.size == 1.5
+
     def test_mutate(self):
         c = Centroid((1, 2, 3, 4, 5))
         with pytest.raises(AttributeError):
             c.center = None
+
+
+class Perturbed(AddC):
+    """AddC backend whose reported centroids are shifted by `eps`."""
+    def __init__(self, kmax, eps):
+        super(Perturbed, self).__init__(kmax)
+        self.eps = eps
+
+    @property
+    def centroids(self):
+        return [tuple(x + self.eps for x in c)
+                for c in super(Perturbed, self).centroids]
+
+
+class TestReplay:
+    def test_random_stream(self):
+        ps1, ws1 = random_stream(100, dim=3, max_weight=4, seed=1)
+        ps2, ws2 = random_stream(100, dim=3, max_weight=4, seed=1)
+        assert ps1 == ps2 and ws1 == ws2
+        assert len(ps1) == len(ws1) == 100
+        assert all(len(p) == 3 for p in ps1)
+        assert all(1 <= w <= 4 for w in ws1)
+        assert random_stream(100, seed=2)[0] != ps1
+
+    def test_divergence(self):
+        a = [(0, 0), (1, 1)]
+        assert divergence(a, a[::-1]) == 0
+        assert abs(divergence(a, [(0, 0), (1, 2)]) - 1) < 1e-8
+        assert divergence(a, a[:1]) == float("inf")
+        assert divergence([], []) == 0
+        nan = [(0, float("nan"))]
+        assert divergence(nan, nan) == float("inf")
+
+    def test_replay_tolerance(self):
+        ps, ws = random_stream(200, seed=8714)
+        # Below tolerance: reported, but not counted as a divergence
+        report = replay(ps, lambda: AddC(10), lambda: Perturbed(10, 1e-12),
+                        ws)
+        assert report.steps == len(ps)
+        assert 0 < report.divergence < 1e-8
+        assert report.first_divergence is None
+        assert report.reference_time > 0 and report.candidate_time > 0
+        assert report.speedup > 0
+        # Above tolerance: diverges at the first step that is compared
+        report = replay(ps, lambda: AddC(10), lambda: Perturbed(10, 1e-6),
+                        ws)
+        assert 1e-8 < report.divergence < 1e-5
+        assert report.first_divergence == 0
+        report = replay(ps, lambda: AddC(10), lambda: Perturbed(10, 1e-6),
+                        ws, every=10)
+        assert report.first_divergence == 9
+        report = replay(ps, lambda: AddC(10), lambda: Perturbed(10, 1e-6),
+                        ws, tol=1e-5)
+        assert report.first_divergence is None
+
+    def test_replay_divergent(self):
+        ps, ws = random_stream(200, seed=8714)
+        # A slightly different centroid kernel: same number of centroids,
+        # but their updates (and hence centers) drift apart
+        factory = tuned_centroid(KernelCentroid, gaussian, 1.01)
+        report = replay(ps, lambda: AddC(10),
+                        lambda: AddC(10, centroid_factory=factory), ws)
+        assert 1e-8 < report.divergence < float("inf")
+        assert report.first_divergence is not None
+        # Warm-up delays the candidate's centroids entirely
+        report = replay(ps, lambda: AddC(10), lambda: AddC(10, warmup=50),
+                        ws, every=10)
+        assert report.divergence == float("inf")
+        assert report.first_divergence == 9  # First compared step
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_weighted_invariants(self, seed):
+        ps, ws = random_stream(200, dim=3, max_weight=5, seed=seed)
+        ac = AddC(10)
+        for p, w in zip(ps, ws):
+            ac.add(p, w)
+            s = ac.summary()
+            assert len(ac) <= ac.kmax
+            assert all(s.sizes >= 0)
+            # The first point is only ever a 'redundant' centroid
+            assert s.counts.sum() == ac.npoints - ws[0]
+        assert ac.npoints == sum(ws)
+
+
+def read_shared(name, queue):
+    # Runs in a separate process
+    with SharedCentroidsReader(name) as reader:
+        snapshot = reader.read()
+        queue.put((snapshot.version, snapshot.centers.tolist(),
+                   reader.predict(snapshot.centers).tolist()))
+
+
+def write_shared(queue, done):
+    # Runs in a separate process
+    ps = PointSet()
+    ac = AddC(10).batch(ps)
+    with SharedCentroids(ac, dim=len(ps[0])) as shared:
+        shared.publish()
+        queue.put(shared.name)
+        done.wait(60)
+
+
+@pytest.mark.skipif(shared_memory is None,
+                    reason="shared memory requires Python 3.8 or later")
+class TestShared:
+    def test_publish_read(self):
+        ps = PointSet()
+        ac = AddC(10).batch(ps)
+        with SharedCentroids(ac, dim=len(ps[0])) as shared:
+            with SharedCentroidsReader(shared.name) as reader:
+                assert reader.version == shared.version == 0
+                assert len(reader.read().centers) == 0
+                with pytest.raises(ValueError):
+                    reader.predict(ps[0])
+                assert shared.publish() == 1
+                snapshot = reader.read()
+                s = ac.summary()
+                assert snapshot.version == 1
+                assert (snapshot.centers == s.centers).all()
+                assert (snapshot.counts == s.counts).all()
+                assert (snapshot.sizes == s.sizes).all()
+                ac += ps[0]
+                assert shared.publish() == reader.version == 2
+
+    def test_predict(self):
+        ps = PointSet()
+        ac = AddC(10).batch(ps)
+        with SharedCentroids(ac, dim=len(ps[0])) as shared:
+            shared.publish()
+            with SharedCentroidsReader(shared.name) as reader:
+                labels = reader.predict(ps)
+        for p, label in zip(ps, labels):
+            dists = [ac.fastpair.dist(p, c) for c in ac.centroids]
+            assert dists[label] == min(dists)
+
+    def test_dim_mismatch(self):
+        ac = AddC(10).batch(PointSet(10, 3))
+        with SharedCentroids(ac, dim=2) as shared:
+            with pytest.raises(ValueError):
+                shared.publish()
+
+    def test_other_process(self):
+        ps = PointSet()
+        ac = AddC(10).batch(ps)
+        with SharedCentroids(ac, dim=len(ps[0])) as shared:
+            shared.publish()
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=read_shared,
+                                           args=(shared.name, queue))
+            proc.start()
+            version, centers, labels = queue.get(timeout=30)
+            proc.join()
+        assert version == 1
+        assert centers == ac.summary().centers.tolist()
+        assert labels == list(range(len(centers)))
+
+    def test_independent_process(self):
+        # A reader outside of multiprocessing has its own resource tracker,
+        # which must not unlink the segment when the reader exits
+        ps = PointSet()
+        ac = AddC(10).batch(ps)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(
+            sys.modules["addc"].__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [root] + env.get("PYTHONPATH", "").split(os.pathsep))
+        code = ("import sys; from addc import SharedCentroidsReader; "
+                "r = SharedCentroidsReader(sys.argv[1]); "
+                "print(r.read().version); r.close()")
+        with SharedCentroids(ac, dim=len(ps[0])) as shared:
+            shared.publish()
+            proc = subprocess.run([sys.executable, "-c", code, shared.name],
+                                  env=env, capture_output=True, text=True,
+                                  timeout=60)
+            assert proc.stdout.strip() == "1", proc.stderr
+            assert "leaked" not in proc.stderr
+            with SharedCentroidsReader(shared.name) as reader:
+                assert reader.version == 1
+
+    def test_torn_read(self):
+        ps = PointSet()
+        ac = AddC(10).batch(ps)
+        with SharedCentroids(ac, dim=len(ps[0])) as shared:
+            with SharedCentroidsReader(shared.name) as reader:
+                calls = []
+
+                def func(centers, counts, sizes):
+                    # Simulate a publish finishing mid-read of an empty
+                    # segment, so the first attempt looks invalid
+                    calls.append(len(centers))
+                    if len(calls) == 1:
+                        shared.publish()
+                        raise ValueError("no centroids have been published")
+                    return len(centers)
+                assert reader._consistent(func) == (1, 10)
+                assert calls == [0, 10]
+
+    def test_spawned_writer(self, monkeypatch):
+        # A spawned writer shares this process's resource tracker, so the
+        # reader must leave the writer's registration alone
+        from addc import shared as shared_module
+        tracker = shared_module.resource_tracker
+        unregister, unregistered = tracker.unregister, []
+
+        def record(name, rtype):
+            if rtype == "shared_memory":
+                unregistered.append(name)
+            unregister(name, rtype)
+        monkeypatch.setattr(tracker, "unregister", record)
+        ctx = multiprocessing.get_context("spawn")
+        queue, done = ctx.Queue(), ctx.Event()
+        proc = ctx.Process(target=write_shared, args=(queue, done))
+        proc.start()
+        try:
+            name = queue.get(timeout=60)
+            with SharedCentroidsReader(name) as reader:
+                assert reader.read().version == 1
+        finally:
+            done.set()
+            proc.join(60)
+        assert proc.exitcode == 0
+        assert unregistered == []
+
+    def test_kmax_one(self):
+        ps = PointSet()
+        ac = AddC(1).batch(ps)
+        assert len(ac) == 2
+        with SharedCentroids(ac, dim=len(ps[0])) as shared:
+            assert shared.publish() == 1
+            with SharedCentroidsReader(shared.name) as reader:
+                assert len(reader.read().centers) == 2
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""AddC: Data-structure for online/streaming clustering.
+
+Benchmark comparing a fixed (sigma=1) Gaussian kernel against a bandwidth
+estimated from a warm-up sample, in terms of both cluster quality and
+throughput (averaged over several random seeds). Data are generated at
+several scales: as the scale grows, a fixed bandwidth saturates (all
+kernel-induced distances approach 2), while the warm-up estimate scales
+with the data.
+
+Usage: python benchmarks/bandwidth.py
+"""
+
+# Copyright (c) 2016, Carson J. Q. Farmer <carsonfarmer@gmail.com>
+# Licensed under the MIT Licence (http://opensource.org/licenses/MIT).
+
+from __future__ import print_function, division, absolute_import
+import random
+import timeit
+from math import sqrt
+from addc import AddC
+
+
+def cluster_data(n=500, means=[(.6, .5), (.3, .8), (.2, .4)], sd=0.02,
+                 scale=1.0):
+    data = [tuple(scale*random.normalvariate(m, sd) for m in mean)
+            for _ in range(n) for mean in means]
+    data += [tuple(scale*random.random() for _ in range(2))
+             for _ in range(n//2)]  # Noise
+    random.shuffle(data)
+    return data
+
+
+def error(centroids, means, scale):
+    # Mean distance from each true cluster mean to its closest centroid,
+    # in units of the original (unscaled) data
+    if len(centroids) == 0:
+        return float("inf")
+    return sum(min(sqrt(sum((c - scale*m)**2 for c, m in zip(cen, mean)))
+                   for cen in centroids)
+               for mean in means) / (len(means)*scale)
+
+
+def run(points, means, scale, **kw):
+    ac = AddC(kmax=10, **kw)
+    start = timeit.default_timer()
+    ac.batch(points)
+    if ac.sigma is None and ac.warmup > 0:
+        ac.tune()
+    elapsed = timeit.default_timer() - start
+    trimmed = [c.center for c in ac.trim(0.2)]
+    return (len(points) / elapsed, len(trimmed),
+            error(trimmed, means, scale), ac.sigma or 1.0)
+
+
+if __name__ == "__main__":
+    means = [(.6, .5), (.3, .8), (.2, .4)]
+    seeds = range(5)
+    row = "{:>8} {:>10} {:>8} {:>12} {:>9} {:>8}"
+    print(row.format("scale", "mode", "sigma", "points/sec", "clusters",
+                     "error"))
+    for scale in (1, 10, 100):
+        for mode, kw in (("fixed", {}), ("warmup", {"warmup": 200})):
+            results = []
+            for seed in seeds:
+                random.seed(seed)
+                points = cluster_data(means=means, sd=0.05, scale=scale)
+                results.append(run(points, means, scale, **kw))
+            # Average each column over seeds
+            rate, k, err, sigma = [sum(x) / len(x) for x in zip(*results)]
+            print(row.format(scale, mode, "{:.3g}".format(sigma),
+                             "{:.0f}".format(rate), "{:.1f}".format(k),
+                             "{:.4f}".format(err)))
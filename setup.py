@@ -56,7 +56,7 @@ setup(name=PACKAGE_NAME, version=FULLVERSION, description=DESCRIPTION,
       author_email='carsonfarmer@gmail.com',
       keywords="streaming clustering algorithm addc kmeans online",
       long_description=DESCRIPTION, packages=find_packages("."),
-      install_requires=["fastpair"], zip_safe=True,
+      install_requires=["fastpair", "numpy"], zip_safe=True,
       setup_requires=["pytest-runner",], tests_require=["pytest",],
       classifiers=["Development Status :: 2 - Pre-Alpha",
                    "Environment :: Console",